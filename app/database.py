@@ -1,10 +1,10 @@
-import redis
+import redis.asyncio as aioredis
 import os
 from typing import Optional
 
 class RedisConnection:
     _instance: Optional['RedisConnection'] = None
-    _client: Optional[redis.Redis] = None
+    _client: Optional[aioredis.Redis] = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -14,34 +14,34 @@ class RedisConnection:
     def __init__(self):
         if self._client is None:
             redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-            self._client = redis.from_url(
+            self._client = aioredis.from_url(
                 redis_url,
                 decode_responses=True,
                 health_check_interval=30
             )
     
     @property
-    def client(self) -> redis.Redis:
+    def client(self) -> aioredis.Redis:
         if self._client is None:
             self.__init__()
         return self._client
     
-    def ping(self) -> bool:
+    async def ping(self) -> bool:
         """Test Redis connection"""
         try:
-            return self._client.ping()
+            return await self._client.ping()
         except Exception:
             return False
     
-    def close(self):
+    async def close(self):
         """Close Redis connection"""
         if self._client:
-            self._client.close()
+            await self._client.aclose()
             self._client = None
 
 # Global instance
 redis_conn = RedisConnection()
 
-def get_redis_client() -> redis.Redis:
+def get_redis_client() -> aioredis.Redis:
     """Get Redis client instance"""
     return redis_conn.client
\ No newline at end of file
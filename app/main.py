@@ -1,16 +1,20 @@
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, TypeVar, Generic, Union, Literal, Any
 import uvicorn
-import json
+import orjson
 import logging
+import asyncio
+import contextlib
 import os
 from dotenv import load_dotenv
 from .database import redis_conn
 from .routers import poll
 from .websocket_manager import manager
+from .pubsub import heartbeat, publish_connection_count, relay_events
+from .migrations import migrate_polls_until_done
 
 # Generic type for API response data
 T = TypeVar('T')
@@ -26,7 +30,8 @@ load_dotenv()
 app = FastAPI(
     title="Poll Server API",
     description="A basic FastAPI server for polling application with Redis storage and WebSocket support",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 ALLOWED_ORIGINS = os.getenv('FRONTEND_URL', '').split(',')
@@ -36,14 +41,15 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS, 
     allow_credentials=True, 
     allow_methods=["*"], 
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"]
 )
 
 # Custom exception handler for HTTPExceptions
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Handle HTTP exceptions and return standardized error response"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "status": "error",
@@ -56,7 +62,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """Handle general exceptions and return standardized error response"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "status": "error",
@@ -96,27 +102,50 @@ class VoteRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    """Test Redis connection on startup"""
-    if redis_conn.ping():
+    """Test Redis connection and migrate stored polls on startup"""
+    redis_status = await redis_conn.ping()
+    if redis_status:
         print("✅ Connected to Redis successfully")
     else:
         print("❌ Failed to connect to Redis")
+    
+    # Migrate stored polls, retrying in the background if Redis isn't reachable yet
+    app.state.poll_migration = asyncio.create_task(migrate_polls_until_done())
+    if redis_status:
+        # Normally finishes here, before any request is served
+        await asyncio.wait([app.state.poll_migration], timeout=30)
+    
+    # Mark this worker alive so other workers count its connections
+    app.state.heartbeat = asyncio.create_task(heartbeat())
+    
+    # Relay poll events published by any worker to this worker's WebSocket clients
+    app.state.event_relay = asyncio.create_task(relay_events(manager))
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close Redis connection on shutdown"""
-    redis_conn.close()
+    """Stop background tasks and close Redis connection on shutdown"""
+    tasks = [app.state.poll_migration, app.state.heartbeat, app.state.event_relay]
+    for task in tasks:
+        task.cancel()
+    # Let the tasks finish before the client they use is closed
+    for task in tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await redis_conn.close()
 
 class HealthData(BaseModel):
     redis: str
 
+HealthDataAPI = APIResponse[HealthData]
+
 @app.get('/api/v1/health')
 async def health_check():
     """Health check endpoint"""
-    redis_status = redis_conn.ping()
-    health_data = HealthData(redis="connected" if redis_status else "disconnected")
+    redis_status = await redis_conn.ping()
+    # Values are built here, so skip revalidation
+    health_data = HealthData.model_construct(redis="connected" if redis_status else "disconnected")
     
-    return APIResponse[HealthData](
+    return HealthDataAPI.model_construct(
         status="success" if redis_status else "error",
         message="Service is healthy" if redis_status else "Service is unhealthy - Redis connection failed",
         data=health_data
@@ -128,13 +157,9 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            # Keep connection alive and handle any client messages
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            # Handle ping/pong for connection health
-            if message.get("type") == "ping":
-                await manager.send_personal_message({"type": "pong"}, websocket)
+            # Wait for the client to disconnect; keepalive is handled by
+            # protocol-level PING frames (ws_ping_interval), not app messages
+            await websocket.receive_text()
                 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -146,13 +171,17 @@ async def websocket_endpoint(websocket: WebSocket):
 async def websocket_poll_endpoint(websocket: WebSocket, poll_id: str):
     """WebSocket endpoint for specific poll updates"""
     await manager.connect(websocket, poll_id)
+    counted = False
     try:
         # Send current poll data when client connects
         from .database import get_redis_client
         redis_client = get_redis_client()
-        poll_data = redis_client.hgetall(f"poll:{poll_id}")
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(f"poll:{poll_id}")
+            pipe.hgetall(f"poll:{poll_id}:votes")
+            poll_data, votes = await pipe.execute()
         if poll_data:
-            options_data = json.loads(poll_data["options"])
+            options_data = poll.merge_vote_counts(orjson.loads(poll_data["options"]), votes)
             current_poll = {
                 "type": "poll_data",
                 "poll_id": poll_id,
@@ -162,35 +191,24 @@ async def websocket_poll_endpoint(websocket: WebSocket, poll_id: str):
             }
             await manager.send_personal_message(current_poll, websocket)
         
-        # Send connection count
-        connection_count = manager.get_poll_connection_count(poll_id)
-        await manager.broadcast_to_poll({
-            "type": "connection_count",
-            "poll_id": poll_id,
-            "count": connection_count
-        }, poll_id)
+        # Count this connection across all workers and send everyone the new total
+        await publish_connection_count(manager, poll_id, 1)
+        counted = True
         
         while True:
-            # Keep connection alive and handle any client messages
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            # Handle ping/pong for connection health
-            if message.get("type") == "ping":
-                await manager.send_personal_message({"type": "pong"}, websocket)
+            # Wait for the client to disconnect; keepalive is handled by
+            # protocol-level PING frames (ws_ping_interval), not app messages
+            await websocket.receive_text()
                 
     except WebSocketDisconnect:
         manager.disconnect(websocket, poll_id)
-        # Update connection count after disconnect
-        connection_count = manager.get_poll_connection_count(poll_id)
-        await manager.broadcast_to_poll({
-            "type": "connection_count",
-            "poll_id": poll_id,
-            "count": connection_count
-        }, poll_id)
     except Exception as e:
         logger.error(f"WebSocket error for poll {poll_id}: {e}")
         manager.disconnect(websocket, poll_id)
+    finally:
+        # Update connection count after disconnect, however the connection ended
+        if counted:
+            await publish_connection_count(manager, poll_id, -1)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_ping_interval=20, ws_ping_timeout=20)
\ No newline at end of file
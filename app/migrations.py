@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from .database import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a step is added below; stored in Redis so each step runs once
+SCHEMA_VERSION = 2
+SCHEMA_VERSION_KEY = "poll_schema_version"
+# Seconds between attempts while Redis is unavailable
+MIGRATION_RETRY_INTERVAL = 5.0
+
+# Move vote counts embedded in the options JSON of a legacy poll into
+# "poll:{id}:votes", and fill "poll:{id}:labels" from the option values.
+# KEYS are the poll, votes and labels hashes. Safe to run more than once:
+# counts are only moved while they are still embedded.
+SPLIT_VOTE_COUNTS_SCRIPT = get_redis_client().register_script("""
+local raw = redis.call('HGET', KEYS[1], 'options')
+if not raw then
+    return 0
+end
+local options = cjson.decode(raw)
+local legacy = false
+for _, opt in ipairs(options) do
+    if opt.vote ~= nil then
+        redis.call('HINCRBY', KEYS[2], opt.id, opt.vote)
+        opt.vote = nil
+        legacy = true
+    end
+    redis.call('HSETNX', KEYS[3], opt.id, opt.value)
+end
+if legacy then
+    redis.call('HSET', KEYS[1], 'options', cjson.encode(options))
+end
+return legacy and 1 or 0
+""")
+
+async def _split_vote_counts(redis_client):
+    """Give every existing poll a votes and labels hash"""
+    poll_ids = set(await redis_client.smembers("polls"))
+    poll_ids.update(await redis_client.zrange("polls_by_time", 0, -1))
+    
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for poll_id in poll_ids:
+            await SPLIT_VOTE_COUNTS_SCRIPT(
+                keys=[f"poll:{poll_id}", f"poll:{poll_id}:votes", f"poll:{poll_id}:labels"],
+                client=pipe
+            )
+        results = await pipe.execute()
+    
+    logger.info(f"Moved vote counts out of {sum(results)} legacy polls")
+
+async def _backfill_time_index(redis_client):
+    """Move polls from the legacy "polls" set into the "polls_by_time" index"""
+    poll_ids = await redis_client.smembers("polls")
+    
+    # Creation times weren't recorded, so legacy polls get score 0 and list after newer ones.
+    # SREM one by one (rather than DEL) so concurrent workers can't drop an unmigrated id.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for poll_id in poll_ids:
+            pipe.zadd("polls_by_time", {poll_id: 0}, nx=True)
+            pipe.srem("polls", poll_id)
+        await pipe.execute()
+    
+    logger.info(f"Indexed {len(poll_ids)} legacy polls by time")
+
+async def migrate_polls():
+    """Bring poll data written by older versions up to the current schema"""
+    redis_client = get_redis_client()
+    version = int(await redis_client.get(SCHEMA_VERSION_KEY) or 0)
+    if version >= SCHEMA_VERSION:
+        return
+    
+    # Steps are idempotent, so workers starting at the same time can run them concurrently
+    if version < 1:
+        await _split_vote_counts(redis_client)
+    if version < 2:
+        await _backfill_time_index(redis_client)
+    
+    await redis_client.set(SCHEMA_VERSION_KEY, SCHEMA_VERSION)
+
+async def migrate_polls_until_done():
+    """Run migrate_polls, retrying until Redis is reachable and it succeeds"""
+    while True:
+        try:
+            await migrate_polls()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Poll migration failed, retrying in {MIGRATION_RETRY_INTERVAL}s: {e}")
+            await asyncio.sleep(MIGRATION_RETRY_INTERVAL)
\ No newline at end of file
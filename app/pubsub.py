@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import orjson
+import uuid
+from typing import Set
+from .database import get_redis_client
+from .websocket_manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# Events for a single poll go to "poll:{id}:events", events for every client
+# (poll created/deleted) go to "polls:events"
+POLL_EVENTS_PATTERN = "poll:*:events"
+ALL_EVENTS_CHANNEL = "polls:events"
+
+def poll_events_channel(poll_id: str) -> str:
+    """Channel name for events about a specific poll"""
+    return f"poll:{poll_id}:events"
+
+# Identifies this worker process in the per-worker connection counts
+WORKER_ID = uuid.uuid4().hex
+# A worker that hasn't refreshed its liveness key for this many seconds is treated as dead
+WORKER_TTL = 30
+HEARTBEAT_INTERVAL = 10
+
+def worker_alive_key(worker_id: str) -> str:
+    """Key whose presence marks a worker as alive"""
+    return f"worker:{worker_id}:alive"
+
+# Adjust this worker's connection count for a poll and return the total across live
+# workers. KEYS are "poll:{id}:connections" (worker_id -> count) and this worker's
+# liveness key; ARGV is worker_id, delta and WORKER_TTL. Fields of workers whose
+# liveness key expired (crashed or killed) are dropped instead of counted. Other
+# workers' liveness keys are built inside the script, so this needs a standalone
+# (non-cluster) Redis.
+CONNECTION_COUNT_SCRIPT = get_redis_client().register_script("""
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[3])
+if redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2]) <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+local total = 0
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    if redis.call('EXISTS', 'worker:' .. fields[i] .. ':alive') == 1 then
+        total = total + tonumber(fields[i + 1])
+    else
+        redis.call('HDEL', KEYS[1], fields[i])
+    end
+end
+return total
+""")
+
+async def publish_connection_count(manager: ConnectionManager, poll_id: str, delta: int):
+    """Record a connection joining (+1) or leaving (-1) a poll and publish the new total"""
+    redis_client = get_redis_client()
+    count = await CONNECTION_COUNT_SCRIPT(
+        keys=[f"poll:{poll_id}:connections", worker_alive_key(WORKER_ID)],
+        args=[WORKER_ID, delta, WORKER_TTL]
+    )
+    await redis_client.publish(poll_events_channel(poll_id), manager.connection_count_message(poll_id, count))
+
+async def heartbeat():
+    """Keep this worker's liveness key fresh so its connections keep being counted"""
+    alive_key = worker_alive_key(WORKER_ID)
+    try:
+        while True:
+            try:
+                await get_redis_client().set(alive_key, 1, ex=WORKER_TTL)
+            except Exception as e:
+                logger.error(f"Worker heartbeat failed: {e}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+    finally:
+        # Stop counting this worker's connections as soon as it shuts down
+        try:
+            await get_redis_client().delete(alive_key)
+        except Exception as e:
+            logger.error(f"Error removing worker liveness key: {e}")
+
+async def publish_to_poll(message: dict, poll_id: str):
+    """Publish a message for the connections subscribed to a poll on every worker"""
+    await get_redis_client().publish(poll_events_channel(poll_id), orjson.dumps(message))
+
+async def publish_to_all(message: dict):
+    """Publish a message for every connection on every worker"""
+    await get_redis_client().publish(ALL_EVENTS_CHANNEL, orjson.dumps(message))
+
+async def relay_events(manager: ConnectionManager):
+    """Forward published events to this worker's WebSocket connections"""
+    # Each event fans out in its own task so a slow socket never stops the
+    # subscriber from draining Redis; keep references so tasks aren't collected
+    fan_outs: Set[asyncio.Task] = set()
+    try:
+        while True:
+            pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(POLL_EVENTS_PATTERN)
+                await pubsub.subscribe(ALL_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    channel = message["channel"]
+                    # Payloads are already JSON, so they are forwarded without re-encoding
+                    if channel == ALL_EVENTS_CHANNEL:
+                        fan_out = manager.broadcast_text_to_all(message["data"])
+                    else:
+                        poll_id = channel[len("poll:"):-len(":events")]
+                        fan_out = manager.broadcast_text_to_poll(message["data"], poll_id)
+                    task = asyncio.create_task(fan_out)
+                    fan_outs.add(task)
+                    task.add_done_callback(fan_outs.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Poll event relay error, resubscribing: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    finally:
+        for task in fan_outs:
+            task.cancel()
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Dict, Optional, TypeVar, Generic, Literal
-import json
+import orjson
 import uuid
 import asyncio
+import hashlib
+import time
+from cachetools import TTLCache
+from .. import serialization
 from ..database import get_redis_client
-from ..websocket_manager import manager
+from ..pubsub import publish_to_all, publish_to_poll
 
 # Generic type for API response data
 T = TypeVar('T')
@@ -21,6 +26,23 @@ router = APIRouter(
     tags=["poll"]
 )
 
+# Validate the option, increment its counter and read its label in a single
+# server-side step. KEYS are "poll:{id}:votes" and "poll:{id}:labels". Returns
+# [new_count, option_value], or nil when the option isn't part of the poll.
+# Redis caches the script so later calls only send its SHA (EVALSHA).
+VOTE_SCRIPT = get_redis_client().register_script("""
+local value = redis.call('HGET', KEYS[2], ARGV[1])
+if not value then
+    return false
+end
+return {redis.call('HINCRBY', KEYS[1], ARGV[1], 1), value}
+""")
+
+# Serialized GET /poll/{id} responses keyed by poll_id, stored as (etag, body).
+# Entries are dropped on vote/delete in this worker; the short TTL bounds how
+# stale other workers can be.
+poll_cache: TTLCache = TTLCache(maxsize=10_000, ttl=1.0)
+
 # Pydantic models
 class PollOption(BaseModel):
     id: str
@@ -46,7 +68,23 @@ class VoteData(BaseModel):
     new_vote_count: int
     option_value: str
 
-@router.post("/", response_model=APIResponse[PollResponse])
+class DeleteData(BaseModel):
+    poll_id: str
+
+# Parameterize the generic response models once at import time
+PollResponseAPI = APIResponse[PollResponse]
+PollListResponseAPI = APIResponse[List[PollResponse]]
+VoteDataAPI = APIResponse[VoteData]
+DeleteDataAPI = APIResponse[DeleteData]
+
+def merge_vote_counts(options: List[Dict], votes: Dict[str, str]) -> List[Dict]:
+    """Combine stored option metadata with the per-option vote counters"""
+    return [
+        {"id": opt["id"], "value": opt["value"], "vote": int(votes.get(opt["id"], 0))}
+        for opt in options
+    ]
+
+@router.post("/", responses={200: {"model": PollResponseAPI}})
 async def create_poll(poll: PollCreate):
     """Create a new poll"""
     redis_client = get_redis_client()
@@ -54,182 +92,198 @@ async def create_poll(poll: PollCreate):
     # Generate unique poll ID
     poll_id = str(uuid.uuid4())
     
-    # Create options with unique IDs and initialize vote counts
+    # Create options with unique IDs
     options = []
     for option_value in poll.options:
         option_id = str(uuid.uuid4())
         options.append({
             "id": option_id,
-            "value": option_value,
-            "vote": 0
+            "value": option_value
         })
     
-    # Store poll data in Redis
-    poll_data = {
+    # Write the poll in a single round-trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        # Store poll metadata in Redis with key "poll:{id}"
+        pipe.hset(f"poll:{poll_id}", mapping={
+            "question": poll.question,
+            "description": poll.description or "",
+            "options": orjson.dumps(options).decode()
+        })
+        
+        # Vote counts live in their own hash "poll:{id}:votes" so votes can use HINCRBY,
+        # and option values in "poll:{id}:labels" so votes can look them up by id
+        if options:
+            pipe.hset(f"poll:{poll_id}:votes", mapping={opt["id"]: 0 for opt in options})
+            pipe.hset(f"poll:{poll_id}:labels", mapping={opt["id"]: opt["value"] for opt in options})
+        
+        # Index by creation time so the poll list can be paginated newest first
+        pipe.zadd("polls_by_time", {poll_id: time.time()})
+        await pipe.execute()
+    
+    poll_response = {
+        "id": poll_id,
         "question": poll.question,
         "description": poll.description,
-        "options": options
+        "options": merge_vote_counts(options, {})
     }
     
-    # Store in Redis with key "poll:{id}"
-    redis_client.hset(f"poll:{poll_id}", mapping={
-        "question": poll.question,
-        "description": poll.description or "",
-        "options": json.dumps(options)
-    })
-    
-    # Add to polls list for easy retrieval
-    redis_client.sadd("polls", poll_id)
-    
-    poll_response = PollResponse(
-        id=poll_id,
-        question=poll.question,
-        description=poll.description,
-        options=[PollOption(**opt) for opt in options]
-    )
-    
     # Broadcast new poll creation to all connected clients
     new_poll_notification = {
         "type": "new_poll",
-        "poll": {
-            "id": poll_id,
-            "question": poll.question,
-            "description": poll.description,
-            "options": options
-        }
+        "poll": poll_response
     }
     
-    # Use asyncio.create_task to run the broadcast without blocking the response
-    asyncio.create_task(manager.broadcast_to_all(new_poll_notification))
+    # Publish through Redis so connections on every worker receive it, without blocking the response
+    asyncio.create_task(publish_to_all(new_poll_notification))
     
-    return APIResponse[PollResponse](
-        status="success",
-        message="Poll created successfully",
-        data=poll_response
-    )
+    return ORJSONResponse({
+        "status": "success",
+        "message": "Poll created successfully",
+        "data": poll_response
+    })
 
-@router.get("/{poll_id}", response_model=APIResponse[PollResponse])
-async def get_poll(poll_id: str):
+@router.get("/{poll_id}", responses={200: {"model": PollResponseAPI}})
+async def get_poll(poll_id: str, if_none_match: Optional[str] = Header(None)):
     """Get a specific poll by ID"""
+    cached = poll_cache.get(poll_id)
+    if cached is None:
+        cached = await _load_poll_response(poll_id)
+        poll_cache[poll_id] = cached
+    etag, body = cached
+    
+    # Let clients reuse their copy when the poll hasn't changed
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+async def _load_poll_response(poll_id: str):
+    """Read a poll from Redis and return its (etag, serialized response)"""
     redis_client = get_redis_client()
     
-    # Check if poll exists
-    if not redis_client.exists(f"poll:{poll_id}"):
+    # Retrieve poll metadata and vote counts in a single round-trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(f"poll:{poll_id}")
+        pipe.hgetall(f"poll:{poll_id}:votes")
+        poll_data, votes = await pipe.execute()
+    
+    if not poll_data:
         raise HTTPException(status_code=404, detail="Poll not found")
     
-    # Retrieve poll data
-    poll_data = redis_client.hgetall(f"poll:{poll_id}")
-    options_data = json.loads(poll_data["options"])
+    options_data = merge_vote_counts(orjson.loads(poll_data["options"]), votes)
     
-    poll_response = PollResponse(
-        id=poll_id,
-        question=poll_data["question"],
-        description=poll_data.get("description") or None,
-        options=[PollOption(**opt) for opt in options_data]
-    )
+    poll_response = {
+        "id": poll_id,
+        "question": poll_data["question"],
+        "description": poll_data.get("description") or None,
+        "options": options_data
+    }
     
-    return APIResponse[PollResponse](
-        status="success",
-        message="Poll retrieved successfully",
-        data=poll_response
-    )
+    body = orjson.dumps({
+        "status": "success",
+        "message": "Poll retrieved successfully",
+        "data": poll_response
+    })
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return etag, body
 
-@router.post("/{poll_id}/vote", response_model=APIResponse[VoteData])
+@router.post("/{poll_id}/vote", responses={200: {"model": VoteDataAPI}})
 async def vote_on_poll(poll_id: str, vote: VoteRequest):
     """Vote on a poll"""
     redis_client = get_redis_client()
     
-    # Check if poll exists
-    if not redis_client.exists(f"poll:{poll_id}"):
-        raise HTTPException(status_code=404, detail="Poll not found")
-    
-    # Get current poll data
-    poll_data = redis_client.hgetall(f"poll:{poll_id}")
-    options = json.loads(poll_data["options"])
-    
-    # Find the option by ID and increment vote
-    option_found = False
-    for option in options:
-        if option["id"] == vote.option_id:
-            option["vote"] += 1
-            option_found = True
-            break
-    
-    if not option_found:
+    # Validate and record the vote atomically
+    result = await VOTE_SCRIPT(
+        keys=[f"poll:{poll_id}:votes", f"poll:{poll_id}:labels"],
+        args=[vote.option_id]
+    )
+    if result is None:
+        # Only hit Redis again on the error path to pick the right status code
+        if not await redis_client.exists(f"poll:{poll_id}"):
+            raise HTTPException(status_code=404, detail="Poll not found")
         raise HTTPException(status_code=400, detail="Invalid option ID")
+    new_vote_count, option_value = result
     
-    # Update options in Redis
-    redis_client.hset(f"poll:{poll_id}", "options", json.dumps(options))
-    
-    # Find the voted option for response
-    voted_option = next(opt for opt in options if opt["id"] == vote.option_id)
+    poll_cache.pop(poll_id, None)
     
-    # Broadcast vote update to all connected clients for this poll
+    # Broadcast only what changed; clients already hold the rest of the poll
     vote_update = {
         "type": "vote_update",
         "poll_id": poll_id,
         "option_id": vote.option_id,
-        "new_vote_count": voted_option["vote"],
-        "option_value": voted_option["value"],
-        "all_options": options
+        "new_vote_count": new_vote_count,
+        "option_value": option_value
     }
     
-    # Use asyncio.create_task to run the broadcast without blocking the response
-    asyncio.create_task(manager.broadcast_to_poll(vote_update, poll_id))
+    # Publish through Redis so connections on every worker receive it, without blocking the response
+    asyncio.create_task(publish_to_poll(vote_update, poll_id))
     
-    vote_data = VoteData(
-        option_id=vote.option_id,
-        new_vote_count=voted_option["vote"],
-        option_value=voted_option["value"]
-    )
+    vote_data = {
+        "option_id": vote.option_id,
+        "new_vote_count": new_vote_count,
+        "option_value": option_value
+    }
     
-    return APIResponse[VoteData](
-        status="success",
-        message=f"Vote recorded for '{voted_option['value']}'",
-        data=vote_data
-    )
+    return ORJSONResponse({
+        "status": "success",
+        "message": f"Vote recorded for '{option_value}'",
+        "data": vote_data
+    })
 
-@router.get("/", response_model=APIResponse[List[PollResponse]])
-async def get_all_polls():
-    """Get all polls"""
+@router.get("/", responses={200: {"model": PollListResponseAPI}})
+async def get_all_polls(cursor: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200)):
+    """Get a page of polls, newest first. The next page's cursor is returned in the X-Next-Cursor header"""
     redis_client = get_redis_client()
     
-    # Get all poll IDs
-    poll_ids = redis_client.smembers("polls")
+    # Get the poll IDs for this page
+    poll_ids = await redis_client.zrevrange("polls_by_time", cursor, cursor + limit - 1)
+    
+    # Fetch every poll and its vote counts in a single round-trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for poll_id in poll_ids:
+            pipe.hgetall(f"poll:{poll_id}")
+            pipe.hgetall(f"poll:{poll_id}:votes")
+        results = await pipe.execute()
     
     polls = []
-    for poll_id in poll_ids:
-        if redis_client.exists(f"poll:{poll_id}"):
-            poll_data = redis_client.hgetall(f"poll:{poll_id}")
-            options_data = json.loads(poll_data["options"])
-            polls.append(PollResponse(
-                id=poll_id,
-                question=poll_data["question"],
-                description=poll_data.get("description") or None,
-                options=[PollOption(**opt) for opt in options_data]
-            ))
-    
-    return APIResponse[List[PollResponse]](
-        status="success",
-        message=f"Retrieved {len(polls)} polls successfully",
-        data=polls
-    )
-
-class DeleteData(BaseModel):
-    poll_id: str
+    for poll_id, poll_data, votes in zip(poll_ids, results[::2], results[1::2]):
+        # HGETALL returns an empty dict for polls that no longer exist
+        if not poll_data:
+            continue
+        polls.append(serialization.PollResponse(
+            id=poll_id,
+            question=poll_data["question"],
+            description=poll_data.get("description") or None,
+            options=serialization.decode_poll_options(poll_data["options"], votes)
+        ))
+    
+    content = serialization.encode({
+        "status": "success",
+        "message": f"Retrieved {len(polls)} polls successfully",
+        "data": polls
+    })
+    
+    # A full page means there may be more polls after it
+    headers = {"X-Next-Cursor": str(cursor + limit)} if len(poll_ids) == limit else None
+    return Response(content=content, media_type="application/json", headers=headers)
 
-@router.delete("/{poll_id}", response_model=APIResponse[DeleteData])
+@router.delete("/{poll_id}", responses={200: {"model": DeleteDataAPI}})
 async def delete_poll(poll_id: str):
     """Delete a poll"""
     redis_client = get_redis_client()
     
-    # Check if poll exists
-    if not redis_client.exists(f"poll:{poll_id}"):
+    # Delete poll data in a single round-trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(f"poll:{poll_id}")
+        pipe.delete(f"poll:{poll_id}:votes", f"poll:{poll_id}:labels")
+        pipe.zrem("polls_by_time", poll_id)
+        deleted, _, _ = await pipe.execute()
+    
+    # DEL returns the number of keys removed, so 0 means the poll didn't exist
+    if not deleted:
         raise HTTPException(status_code=404, detail="Poll not found")
     
-    # Delete poll data
-    redis_client.delete(f"poll:{poll_id}")
-    redis_client.srem("polls", poll_id)
+    poll_cache.pop(poll_id, None)
     
     # Broadcast poll deletion to all connected clients
     poll_deleted_notification = {
@@ -237,13 +291,13 @@ async def delete_poll(poll_id: str):
         "poll_id": poll_id
     }
     
-    # Use asyncio.create_task to run the broadcast without blocking the response
-    asyncio.create_task(manager.broadcast_to_all(poll_deleted_notification))
+    # Publish through Redis so connections on every worker receive it, without blocking the response
+    asyncio.create_task(publish_to_all(poll_deleted_notification))
     
-    delete_data = DeleteData(poll_id=poll_id)
+    delete_data = {"poll_id": poll_id}
     
-    return APIResponse[DeleteData](
-        status="success",
-        message=f"Poll {poll_id} deleted successfully",
-        data=delete_data
-    )
\ No newline at end of file
+    return ORJSONResponse({
+        "status": "success",
+        "message": f"Poll {poll_id} deleted successfully",
+        "data": delete_data
+    })
\ No newline at end of file
@@ -0,0 +1,35 @@
+import msgspec
+from typing import Dict, List, Optional
+
+# msgspec structs used only to encode poll responses. Request bodies are still
+# validated with the Pydantic models in the routers.
+
+class StoredOption(msgspec.Struct):
+    id: str
+    value: str
+
+class PollOption(msgspec.Struct):
+    id: str
+    value: str
+    vote: int
+
+class PollResponse(msgspec.Struct):
+    id: str
+    question: str
+    description: Optional[str]
+    options: List[PollOption]
+
+# Reuse a single encoder/decoder instead of building one per call
+_options_decoder = msgspec.json.Decoder(List[StoredOption])
+_encoder = msgspec.json.Encoder()
+
+def decode_poll_options(raw_options: str, votes: Dict[str, str]) -> List[PollOption]:
+    """Decode the stored options JSON and attach the per-option vote counts"""
+    return [
+        PollOption(id=opt.id, value=opt.value, vote=int(votes.get(opt.id, 0)))
+        for opt in _options_decoder.decode(raw_options)
+    ]
+
+def encode(obj) -> bytes:
+    """Encode a response body to JSON"""
+    return _encoder.encode(obj)
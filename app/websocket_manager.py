@@ -1,17 +1,32 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List, Set
-import json
+from typing import Dict, Iterable, List, Optional, Set
+import orjson
 import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Seconds a single send may take before the client is considered unresponsive
+SEND_TIMEOUT = 2.0
+# Seconds to wait for an unresponsive client's close frame to be written
+CLOSE_TIMEOUT = 1.0
+# Broadcasts in flight per connection before the client is considered too slow
+MAX_PENDING_SENDS = 32
+
 class ConnectionManager:
     def __init__(self):
         # Store active connections per poll
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.active_connections: Dict[str, List[WebSocket]] = {}
+        # Index of each connection within its poll's list, for O(1) swap-remove
+        self._positions: Dict[str, Dict[WebSocket, int]] = {}
+        # Reverse index of the polls each connection is subscribed to
+        self.connection_polls: Dict[WebSocket, List[str]] = {}
         # Store all connections for global broadcasts
         self.all_connections: Set[WebSocket] = set()
+        # Pre-encoded connection_count message prefix per poll
+        self._count_prefixes: Dict[str, str] = {}
+        # Number of unfinished broadcast sends per connection
+        self._pending_sends: Dict[WebSocket, int] = {}
     
     async def connect(self, websocket: WebSocket, poll_id: str = None):
         """Accept a WebSocket connection and add to appropriate groups"""
@@ -22,58 +37,121 @@ class ConnectionManager:
         
         # If poll_id is provided, add to poll-specific connections
         if poll_id:
-            if poll_id not in self.active_connections:
-                self.active_connections[poll_id] = set()
-            self.active_connections[poll_id].add(websocket)
+            positions = self._positions.setdefault(poll_id, {})
+            if websocket not in positions:
+                connections = self.active_connections.setdefault(poll_id, [])
+                positions[websocket] = len(connections)
+                connections.append(websocket)
+                self.connection_polls.setdefault(websocket, []).append(poll_id)
             
         logger.info(f"WebSocket connected. Poll: {poll_id}, Total connections: {len(self.all_connections)}")
     
+    def _remove_from_poll(self, websocket: WebSocket, poll_id: str):
+        """Swap-remove a connection from a poll group"""
+        positions = self._positions.get(poll_id)
+        if not positions or websocket not in positions:
+            return
+        connections = self.active_connections[poll_id]
+        index = positions.pop(websocket)
+        last = connections.pop()
+        # Move the last connection into the freed slot and record its new position
+        if index < len(connections):
+            connections[index] = last
+            positions[last] = index
+        # Clean up empty poll groups
+        if not connections:
+            del self.active_connections[poll_id]
+            del self._positions[poll_id]
+            self._count_prefixes.pop(poll_id, None)
+    
     def disconnect(self, websocket: WebSocket, poll_id: str = None):
         """Remove a WebSocket connection from all groups"""
         # Remove from all connections
         self.all_connections.discard(websocket)
         
-        # Remove from poll-specific connections
-        if poll_id and poll_id in self.active_connections:
-            self.active_connections[poll_id].discard(websocket)
-            # Clean up empty poll groups
-            if not self.active_connections[poll_id]:
-                del self.active_connections[poll_id]
-        
-        # Also remove from all poll groups if poll_id wasn't specified
-        if not poll_id:
-            for pid in list(self.active_connections.keys()):
-                self.active_connections[pid].discard(websocket)
-                if not self.active_connections[pid]:
-                    del self.active_connections[pid]
+        # Remove from poll-specific connections, or from every poll the
+        # connection joined if poll_id wasn't specified
+        poll_ids = self.connection_polls.get(websocket, [])
+        for pid in ([poll_id] if poll_id else list(poll_ids)):
+            self._remove_from_poll(websocket, pid)
+            if pid in poll_ids:
+                poll_ids.remove(pid)
+        if not poll_ids:
+            self.connection_polls.pop(websocket, None)
                     
         logger.info(f"WebSocket disconnected. Poll: {poll_id}, Total connections: {len(self.all_connections)}")
     
+    async def _close_unresponsive(self, websocket: WebSocket):
+        """Close a connection whose send timed out so the client knows to reconnect"""
+        # The timed out send may have been cancelled mid-frame, so closing can fail too
+        try:
+            await asyncio.wait_for(websocket.close(code=1011), timeout=CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error closing unresponsive connection: {e}")
+    
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Send a message to a specific WebSocket connection"""
         try:
-            await websocket.send_text(json.dumps(message))
+            await asyncio.wait_for(websocket.send_text(orjson.dumps(message).decode()), timeout=SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out sending personal message after {SEND_TIMEOUT}s")
+            self.all_connections.discard(websocket)
+            await self._close_unresponsive(websocket)
         except Exception as e:
             logger.error(f"Error sending personal message: {e}")
             # Remove broken connection
             self.all_connections.discard(websocket)
     
+    async def _send_or_report(self, connection: WebSocket, payload: str) -> Optional[WebSocket]:
+        """Send a payload to one connection, returning the connection if the send failed"""
+        pending = self._pending_sends.get(connection, 0)
+        if pending >= MAX_PENDING_SENDS:
+            # Apply backpressure: rather than queue more for a client that can't keep up
+            # (or silently skip messages), close it so it reconnects and resyncs
+            logger.error(f"Closing slow connection with {pending} pending sends")
+            await self._close_unresponsive(connection)
+            return connection
+        
+        self._pending_sends[connection] = pending + 1
+        try:
+            await asyncio.wait_for(connection.send_text(payload), timeout=SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out broadcasting message after {SEND_TIMEOUT}s")
+            await self._close_unresponsive(connection)
+            return connection
+        except Exception as e:
+            logger.error(f"Error broadcasting message: {e}")
+            return connection
+        finally:
+            remaining = self._pending_sends.get(connection, 1) - 1
+            if remaining > 0:
+                self._pending_sends[connection] = remaining
+            else:
+                self._pending_sends.pop(connection, None)
+        return None
+    
+    async def _send_to_connections(self, connections: Iterable[WebSocket], payload: str) -> List[WebSocket]:
+        """Send an already serialized payload to many connections and return the ones that failed"""
+        # Send to every connection concurrently so one slow client doesn't stall the rest.
+        # The send coroutines are created before the first await, so the live
+        # collection can be passed in without copying it.
+        results = await asyncio.gather(
+            *(self._send_or_report(connection, payload) for connection in connections)
+        )
+        return [connection for connection in results if connection is not None]
+    
     async def broadcast_to_poll(self, message: dict, poll_id: str):
         """Broadcast a message to all connections subscribed to a specific poll"""
+        # Serialize once per fan-out, not once per connection
+        await self.broadcast_text_to_poll(orjson.dumps(message).decode(), poll_id)
+    
+    async def broadcast_text_to_poll(self, payload: str, poll_id: str):
+        """Broadcast an already serialized message to all connections subscribed to a specific poll"""
         if poll_id not in self.active_connections:
             logger.info(f"No connections for poll {poll_id}")
             return
         
-        # Create a copy of the set to avoid modification during iteration
-        connections = self.active_connections[poll_id].copy()
-        broken_connections = set()
-        
-        for connection in connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting to poll {poll_id}: {e}")
-                broken_connections.add(connection)
+        broken_connections = await self._send_to_connections(self.active_connections[poll_id], payload)
         
         # Remove broken connections
         for broken_conn in broken_connections:
@@ -81,28 +159,34 @@ class ConnectionManager:
     
     async def broadcast_to_all(self, message: dict):
         """Broadcast a message to all active connections"""
+        # Serialize once per fan-out, not once per connection
+        await self.broadcast_text_to_all(orjson.dumps(message).decode())
+    
+    async def broadcast_text_to_all(self, payload: str):
+        """Broadcast an already serialized message to all active connections"""
         if not self.all_connections:
             logger.info("No active connections for broadcast")
             return
         
-        # Create a copy of the set to avoid modification during iteration
-        connections = self.all_connections.copy()
-        broken_connections = set()
-        
-        for connection in connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting to all: {e}")
-                broken_connections.add(connection)
+        broken_connections = await self._send_to_connections(self.all_connections, payload)
         
         # Remove broken connections
         for broken_conn in broken_connections:
             self.disconnect(broken_conn)
     
+    def connection_count_message(self, poll_id: str, count: int) -> str:
+        """Serialized connection_count message for a poll"""
+        # Only the count changes between messages, so the rest of the JSON is built once per poll
+        prefix = self._count_prefixes.get(poll_id)
+        if prefix is None:
+            prefix = f'{{"type":"connection_count","poll_id":{orjson.dumps(poll_id).decode()},"count":'
+            if poll_id in self.active_connections:
+                self._count_prefixes[poll_id] = prefix
+        return f"{prefix}{count}}}"
+    
     def get_poll_connection_count(self, poll_id: str) -> int:
         """Get the number of active connections for a specific poll"""
-        return len(self.active_connections.get(poll_id, set()))
+        return len(self.active_connections.get(poll_id, ()))
     
     def get_total_connection_count(self) -> int:
         """Get the total number of active connections"""
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+"""
+Poll Server - Development server with auto-reload
+"""
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True, ws_ping_interval=20, ws_ping_timeout=20)
\ No newline at end of file
@@ -4,5 +4,26 @@ Poll Server - A basic FastAPI application for creating and managing polls
 """
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    from dotenv import load_dotenv
+    
+    # The worker count is read here, before app.main loads .env in each worker
+    load_dotenv()
+    
+    # sched_getaffinity respects the CPUs a container is pinned to, unlike cpu_count;
+    # set WORKERS to override (e.g. under a CPU quota)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers = int(os.getenv("WORKERS") or 0) or cpus
+    
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        reload=False,
+        ws_ping_interval=20,
+        ws_ping_timeout=20
+    )
\ No newline at end of file